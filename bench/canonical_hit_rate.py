@@ -0,0 +1,49 @@
+# Title-cache hit rate with and without URL canonicalization, no network needed
+# python bench/canonical_hit_rate.py [links.txt] [cache size]
+import asyncio
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.logic import Parser
+
+
+# Stand-in for the network, counts the fetches that reach it
+class CountingFetcher:
+    def __init__(self):
+        self.calls = 0
+
+    def fetch(self, url):
+        self.calls += 1
+        return f"<title>{url}</title>"
+
+
+async def run(links, cache_size, canonicalize):
+    with tempfile.TemporaryDirectory() as tmp:
+        fetcher = CountingFetcher()
+        parser = Parser(db_path=os.path.join(tmp, "bench.db"), fetcher=fetcher)
+        parser.MAX_CACHE_SIZE = cache_size
+        if not canonicalize:
+            parser.canonicalize_url = lambda word: word
+        for link in links: # One link per message, as posted
+            await parser.parse(link, "Safe_Scan")
+        return fetcher.calls
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "links.txt")
+    cache_size = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    with open(path, encoding="utf-8") as f:
+        links = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+    print(f"{len(links)} links, cache size {cache_size}")
+    for canonicalize in (False, True):
+        fetches = asyncio.run(run(links, cache_size, canonicalize))
+        label = "canonical keys" if canonicalize else "raw keys"
+        print(f"  {label:15} {fetches:4} fetches, hit rate {1 - fetches / len(links):.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,64 @@
-import tkinter as tk
-from src.gui import ParserGUI
+import argparse
+import asyncio
+import sys
+
+from src.logic import Parser
+from src.analytics import CorpusAnalytics
+
+
+# Fetches titles for a list of links (one per line, '#' for comments) ahead of time
+def prefetch(args):
+    stream = sys.stdin if args.prefetch == "-" else open(args.prefetch, encoding="utf-8")
+    with stream:
+        urls = [line.strip() for line in stream if line.strip() and not line.lstrip().startswith("#")]
+
+    def progress(done, total, url, title, fetch_time):
+        print(f"[{done}/{total}] {url} - {title} ({fetch_time}s)")
+
+    parser = Parser(db_path=args.db, shared=args.shared)
+    summary = asyncio.run(parser.prefetch(urls, max_concurrency=args.concurrency, progress=progress))
+
+    print(
+        f"\n{summary['links']} links: {summary['fetched']} fetched, {summary['already_cached']} already cached, "
+        f"{summary['no_title']} without a title\n"
+        f"Elapsed {summary['elapsed']}s (total fetch time {summary['total_fetch_time']}s, slowest {summary['slowest_fetch']}s)")
+
+
+# Parses a corpus (one message per line) into per-message columns and writes a distribution report
+def analyze(args):
+    parser = Parser(db_path=args.db, shared=args.shared)
+    analytics = CorpusAnalytics(parser, mode=args.mode)
+    stream = sys.stdin if args.analyze == "-" else open(args.analyze, encoding="utf-8")
+    with stream:
+        analytics.add_corpus(stream)
+
+    report = analytics.write_report(args.report)
+    print(
+        f"{report['messages']} messages in {report['elapsed']}s ({report['bytes_per_message']} bytes per message), "
+        f"{report['fetch_share']:.1%} would fetch a link - report saved to {args.report}")
+
 
 if __name__ == "__main__":
-    root = tk.Tk()
-    app = ParserGUI(root)
-    root.mainloop()
\ No newline at end of file
+    arg_parser = argparse.ArgumentParser(description="Chat Message Parser (opens the GUI when run without options)")
+    arg_parser.add_argument("--prefetch", metavar="FILE", help="warm the link cache with the links in FILE ('-' for stdin)")
+    arg_parser.add_argument("--analyze", metavar="FILE", help="write a report on the messages in FILE, one per line ('-' for stdin)")
+    arg_parser.add_argument("--report", default="report.json", help="analyze report path, .json or .csv (default report.json)")
+    arg_parser.add_argument("--mode", default="Full_Sweep", choices=["Full_Sweep", "Safe_Scan"], help="analyze parse mode")
+    arg_parser.add_argument("--concurrency", type=int, default=8, help="max fetches at once when prefetching (default 8)")
+    arg_parser.add_argument("--db", default="data.db", help="database path (default data.db)")
+    arg_parser.add_argument("--shared", action="store_true", help="use the shared cache mode (several workers on one database)")
+    args = arg_parser.parse_args()
+    if args.concurrency < 1:
+        arg_parser.error("--concurrency must be at least 1")
+
+    if args.prefetch:
+        prefetch(args)
+    elif args.analyze:
+        analyze(args)
+    else:
+        import tkinter as tk
+        from src.gui import ParserGUI
+
+        root = tk.Tk()
+        app = ParserGUI(root)
+        root.mainloop()
@@ -0,0 +1,181 @@
+import csv
+import json
+import time
+from array import array
+from collections import Counter, OrderedDict
+
+from src.config import RESULT_TEMPLATE
+from src.db import ParserDB
+
+PERCENTILES = (50, 90, 99)
+
+# Column per RESULT_TEMPLATE field - counts per message, saturating at the column's max value (counted in "saturated")
+# list categories: 'B' (0-255, 1 byte), int categories: 'H' (0-65535, 2 bytes)
+TYPECODES = {list: 'B', int: 'H'}
+
+
+# Smallest array typecode that holds the given number of bits (a list of ints past 64 bits), and its size in bytes
+def mask_column(bits):
+    for typecode in ('B', 'H', 'I', 'L', 'Q'):
+        column = array(typecode)
+        if column.itemsize * 8 >= bits:
+            return column, column.itemsize
+    return [], -(-bits // 8)
+
+
+class CorpusAnalytics:
+    def __init__(self, parser, mode="Full_Sweep"):
+        self.parser = parser
+        self.mode = mode
+
+        self.categories = list(RESULT_TEMPLATE)
+        self.columns = {k: array(TYPECODES[type(v)]) for k, v in RESULT_TEMPLATE.items()}
+        self.limits = {k: 2 ** (8 * col.itemsize) - 1 for k, col in self.columns.items()}
+        self.saturated = dict.fromkeys(self.columns, 0) # Messages whose count went past the limit (stored as the limit)
+
+        # Bit i set when category i is non-empty, top bit set when the message would trigger a fetch
+        self.fetch_bit = 1 << len(self.categories)
+        self.masks, self.mask_size = mask_column(len(self.categories) + 1)
+
+        # Simulated link cache (keys only), starts from the parser's current cache (the links table in shared mode)
+        if parser.shared:
+            db = ParserDB(parser.db_path, shared=True)
+            rows = db.conn.execute(
+                "SELECT url FROM (SELECT url, last_accessed FROM links ORDER BY last_accessed DESC LIMIT ?) ORDER BY last_accessed",
+                (parser.MAX_CACHE_SIZE,)
+            ).fetchall()
+            db.close()
+            self.url_cache = OrderedDict.fromkeys(url for url, in rows)
+        else:
+            self.url_cache = OrderedDict.fromkeys(parser.url_cache)
+        self.elapsed = 0.0
+
+
+    def add(self, message):
+        result = self.parser.extract_tokens(message, self.mode)
+        mask = 0
+        for i, category in enumerate(self.categories):
+            value = result[category]
+            count = len(value) if isinstance(value, list) else value
+            if count > self.limits[category]:
+                self.saturated[category] += 1
+                count = self.limits[category]
+            self.columns[category].append(count)
+            if count:
+                mask |= 1 << i
+
+        if self.would_fetch(result["links"]):
+            mask |= self.fetch_bit
+        self.masks.append(mask)
+
+
+    # Same LRU behaviour as Parser.parse, without the fetch
+    def would_fetch(self, links):
+        fetch = False
+        for word in links:
+            key = self.parser.canonicalize_url(word)
+            if key in self.url_cache:
+                self.url_cache.move_to_end(key)
+            else:
+                fetch = True
+                self.url_cache[key] = None
+                if len(self.url_cache) > self.parser.MAX_CACHE_SIZE:
+                    self.url_cache.popitem(last=False)
+        return fetch
+
+
+    def add_corpus(self, messages):
+        start = time.perf_counter()
+        for message in messages:
+            self.add(message.rstrip('\n'))
+        self.elapsed += time.perf_counter() - start
+        return self
+
+
+    def bytes_per_message(self):
+        total = sum(col.itemsize * len(col) for col in self.columns.values()) + self.mask_size * len(self.masks)
+        return round(total / max(len(self.masks), 1), 2)
+
+
+    # Percentiles come from the histogram (counts are small integers) instead of sorting the column
+    @staticmethod
+    def distribution(column):
+        histogram = dict(sorted(Counter(column).items()))
+        total = len(column)
+        if not total:
+            return {"mean": 0.0, "max": 0, **{f"p{p}": 0 for p in PERCENTILES}, "histogram": {}}
+
+        stats = {"mean": round(sum(column) / total, 3), "max": max(column)}
+        items = iter(histogram.items())
+        cumulative = 0
+        for p in PERCENTILES:
+            rank = max(1, -(-p * total // 100)) # Nearest rank
+            while cumulative < rank:
+                value, count = next(items)
+                cumulative += count
+            stats[f"p{p}"] = value
+
+        stats["histogram"] = histogram
+        return stats
+
+
+    # mean/max/percentiles are lower bounds when saturated > 0
+    def column_stats(self, category):
+        stats = self.distribution(self.columns[category])
+        histogram = stats.pop("histogram")
+        stats["limit"] = self.limits[category]
+        stats["saturated"] = self.saturated[category]
+        stats["histogram"] = histogram
+        return stats
+
+
+    # Messages where both categories are non-empty (including "fetch")
+    def co_occurrence(self):
+        names = self.categories + ["fetch"]
+        mask_counts = Counter(self.masks)
+        matrix = {}
+        for i, a in enumerate(names):
+            matrix[a] = {}
+            for j, b in enumerate(names):
+                both = (1 << i) | (1 << j)
+                matrix[a][b] = sum(count for mask, count in mask_counts.items() if mask & both == both)
+        return matrix
+
+
+    def report(self):
+        total = len(self.masks)
+        fetching = sum(count for mask, count in Counter(self.masks).items() if mask & self.fetch_bit)
+        return {
+            "messages": total,
+            "mode": self.mode,
+            "elapsed": round(self.elapsed, 3),
+            "bytes_per_message": self.bytes_per_message(),
+            "fetch_share": round(fetching / total, 4) if total else 0.0,
+            "distributions": {category: self.column_stats(category) for category in self.columns},
+            "co_occurrence": self.co_occurrence()
+        }
+
+
+    # .csv -> rows of (section, category, key, value), anything else -> JSON
+    def write_report(self, path):
+        report = self.report()
+        if not path.lower().endswith(".csv"):
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            return report
+
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["section", "category", "key", "value"])
+            for key in ("messages", "mode", "elapsed", "bytes_per_message", "fetch_share"):
+                writer.writerow(["summary", "", key, report[key]])
+            for category, stats in report["distributions"].items():
+                for key, value in stats.items():
+                    if key != "histogram":
+                        writer.writerow(["distribution", category, key, value])
+                for value, count in stats["histogram"].items():
+                    writer.writerow(["histogram", category, value, count])
+            for a, row in report["co_occurrence"].items():
+                for b, count in row.items():
+                    writer.writerow(["co_occurrence", a, b, count])
+        return report
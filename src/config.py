@@ -14,16 +14,39 @@ RESULT_TEMPLATE = {
     "words": 0
 }
 
-#'remove': 'category'
+#'remove': 'category' (openers can be more than one character: '!!', '<@')
 PREFIXES = {
     '@': 'mentions',
     '#': 'hashtags',
 }
 
-#'remove': {x: 'remove', x: 'category'}
+#'remove': {x: 'remove', x: 'category'} (openers/closers can be more than one character: '[[' ']]', closers shouldn't start with a letter or number)
 CHARACTER_PAIRS = {
     '(': {
         'close': ')',
         'category': 'emoticons'
     }
-}
\ No newline at end of file
+}
+
+# Query parameters stripped from links before cache lookup (entries ending in '_' match as a prefix)
+TRACKING_PARAMS = (
+    'utm_',
+    'fbclid',
+    'gclid',
+    'dclid',
+    'msclkid',
+    'mc_cid',
+    'mc_eid',
+    'igshid',
+    'yclid',
+    '_ga',
+    'ref_src',
+)
+
+# Scheme added to links without one (www.example.com)
+DEFAULT_URL_SCHEME = 'https'
+
+# Shared cache (Parser(shared=True), several worker processes on one database), in seconds
+FETCH_LEASE_TIME = 30    # How long a worker may hold a link it's fetching before others take over
+EVICTION_LEASE_TIME = 60 # How long a worker stays the only one evicting links
+SHARED_POLL_INTERVAL = 0.05 # Wait between checks for a link another worker is fetching
@@ -1,9 +1,13 @@
 import sqlite3
+import time
 from src.config import DEFAULT_CONFIG
 
 class ParserDB:
-    def __init__(self, db_path="data.db"):
-        self.conn = sqlite3.connect(db_path)
+    def __init__(self, db_path="data.db", shared=False):
+        self.conn = sqlite3.connect(db_path, timeout=30)
+        # WAL lets worker processes read while another one writes
+        if shared:
+            self.conn.execute("PRAGMA journal_mode=WAL")
         self.create_table()
         
     def create_table(self):
@@ -23,6 +27,13 @@ class ParserDB:
                 last_accessed INTEGER
             )
         """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                owner TEXT,
+                expires REAL
+            )
+        """)
         self.conn.execute("""
             CREATE TABLE IF NOT EXISTS config (
                 key TEXT PRIMARY KEY,
@@ -52,13 +63,58 @@ class ParserDB:
 
     # Links
     def add_link(self, url, title, fetch_time, last_accessed):
+        self.add_links([(url, title, fetch_time, last_accessed)])
+
+    # rows: (url, title, fetch_time, last_accessed)
+    def add_links(self, rows):
         cur = self.conn.cursor()
-        cur.execute("""
+        cur.executemany("""
             INSERT INTO links (url, title, fetch_time, last_accessed)
             VALUES (?, ?, ?, ?)
-            ON CONFLICT(url) DO UPDATE SET title=excluded.title, fetch_time=excluded.fetch_time, last_accessed=excluded.last_accessed
-        """, (url, title, fetch_time, last_accessed))
-    
+            ON CONFLICT(url) DO UPDATE SET title=excluded.title, fetch_time=excluded.fetch_time,
+                last_accessed=MAX(last_accessed, excluded.last_accessed)
+        """, rows)
+
+    def get_link(self, url):
+        cur = self.conn.cursor()
+        cur.execute("SELECT title, fetch_time, last_accessed FROM links WHERE url = ?", (url,))
+        return cur.fetchone()
+
+    # Only moves last_accessed forward, so workers touching the same link can't undo each other
+    def touch_link(self, url, last_accessed):
+        cur = self.conn.cursor()
+        cur.execute("""
+            UPDATE links SET last_accessed = MAX(last_accessed, ?)
+            WHERE url = ?
+        """, (last_accessed, url))
+
+    # Keeps the most recently accessed links
+    def evict_links(self, max_size):
+        cur = self.conn.cursor()
+        cur.execute("""
+            DELETE FROM links WHERE url NOT IN (
+                SELECT url FROM links ORDER BY last_accessed DESC LIMIT ?
+            )
+        """, (max_size,))
+        return cur.rowcount
+
+    # Leases (shared cache) - claim succeeds if nobody holds the lease, it expired, or owner already holds it
+    def claim(self, name, owner, ttl):
+        now = time.time()
+        cur = self.conn.cursor()
+        cur.execute("""
+            INSERT INTO leases (name, owner, expires)
+            VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET owner=excluded.owner, expires=excluded.expires
+            WHERE leases.expires < ? OR leases.owner = excluded.owner
+        """, (name, owner, now + ttl, now))
+        self.conn.commit()
+        return cur.rowcount == 1
+
+    def release(self, name, owner):
+        cur = self.conn.cursor()
+        cur.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
     # Configuration
     def set_config(self, key, value):
         cur = self.conn.cursor()
@@ -0,0 +1,76 @@
+import json
+import os
+import threading
+import time
+import urllib.request
+
+# Fetchers return a page's html for Parser.extract_website_title (blocking, run in a seperate thread) and raise on failure
+
+
+# Fetchers raise FetcherError (or a subclass) to fail the parse instead of it being treated like an unreachable site
+class FetcherError(Exception):
+    pass
+
+
+# opener: urllib opener to fetch with (default honours the *_proxy environment variables like urlopen)
+class UrlFetcher:
+    def __init__(self, timeout=5, opener=None):
+        self.timeout = timeout
+        self.opener = opener or urllib.request.build_opener()
+
+    def fetch(self, url):
+        with self.opener.open(url, timeout=self.timeout) as response:
+            return response.read().decode('utf-8', errors='ignore')
+
+
+# Saves every response (or error) from another fetcher to a JSON fixture file {url: {"html": ...} or {"error": ...}}
+class RecordingFetcher:
+    def __init__(self, path, fetcher=None):
+        self.path = path
+        self.fetcher = fetcher or UrlFetcher()
+        self.lock = threading.Lock()
+        self.responses = load_fixtures(path) if os.path.exists(path) else {}
+
+    def fetch(self, url):
+        try:
+            html = self.fetcher.fetch(url)
+        except Exception as e:
+            self.save(url, {"error": str(e)})
+            raise
+        self.save(url, {"html": html})
+        return html
+
+    def save(self, url, entry):
+        with self.lock:
+            self.responses[url] = entry
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(self.responses, f, indent=2, ensure_ascii=False)
+
+
+# Raised by a strict ReplayFetcher for a link without a recording
+class MissingRecording(FetcherError, LookupError):
+    pass
+
+
+# Serves responses from a fixture file without the network, latency (seconds) simulates a slow site
+# strict=True: links without a recording fail the parse (tests), otherwise they're treated like an unreachable site
+class ReplayFetcher:
+    def __init__(self, path, latency=0.0, strict=False):
+        self.responses = load_fixtures(path)
+        self.latency = latency
+        self.strict = strict
+
+    def fetch(self, url):
+        if self.latency:
+            time.sleep(self.latency)
+        entry = self.responses.get(url)
+        if entry is None:
+            raise (MissingRecording if self.strict else LookupError)(f"No recorded response for {url}")
+        if "error" in entry:
+            raise OSError(entry["error"])
+        return entry["html"]
+
+
+def load_fixtures(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
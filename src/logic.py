@@ -1,25 +1,45 @@
 import json
 import re
-import urllib.request
+import urllib.parse
 import asyncio
 import time
 import copy
+import uuid
 from collections import OrderedDict
 
 from src.db import ParserDB
-from src.config import RESULT_TEMPLATE, PREFIXES, CHARACTER_PAIRS, DEFAULT_CONFIG
+from src.matcher import TokenMatcher
+from src.fetch import UrlFetcher, FetcherError
+from src.config import RESULT_TEMPLATE, PREFIXES, CHARACTER_PAIRS, DEFAULT_CONFIG, TRACKING_PARAMS, DEFAULT_URL_SCHEME
+from src.config import FETCH_LEASE_TIME, EVICTION_LEASE_TIME, SHARED_POLL_INTERVAL
+
+TRAILING_PUNCTUATION = '.,!?;:'
+NO_TITLE = "No title found"
+SCHEME_PATTERN = re.compile(r'[A-Za-z][A-Za-z0-9+.-]*://')
 
 class Parser:
-    def __init__(self):
+    # shared=True: several worker processes use one database as their link cache (see fetch_shared)
+    # fetcher: where page html comes from (UrlFetcher, or RecordingFetcher/ReplayFetcher from src/fetch.py)
+    def __init__(self, db_path="data.db", shared=False, fetcher=None):
+        self.db_path = db_path
+        self.shared = shared
+        self.fetcher = fetcher or UrlFetcher()
+        self.worker_id = uuid.uuid4().hex
+        self.links_synced = 0       # Links saved from this time (seconds) on are picked up by reload_links
+        self.in_flight = {}         # Link fetches in progress, shared by messages parsed at the same time
+        self.fetch_semaphore = None # Set by parse_stream to cap fetches
+
         # Load settings from config
         self.load_config()
 
         self.prefixes = PREFIXES
         self.character_pairs = CHARACTER_PAIRS
+        self.tracking_params = TRACKING_PARAMS
 
-        # Load database into cache
+        # Load database into cache (shared mode reads links from the database instead)
         self.url_cache = OrderedDict()
-        self.loads_data_url_cache()
+        if not self.shared:
+            self.loads_data_url_cache()
 
         # Safe Scan Regex
         self.prefix_pattern = re.compile(r'[A-Za-z0-9_]+')
@@ -27,22 +47,19 @@ class Parser:
         self.title_pattern = re.compile(r'<title>(.*?)</title>', re.IGNORECASE | re.DOTALL)
         self.word_pattern = re.compile(r'[A-Za-z0-9]+')
 
-        # Full Sweep Mode Regex
-        prefix_chars = ''.join(re.escape(k) for k in self.prefixes.keys())
-        pair_opens = ''.join(re.escape(k) for k in self.character_pairs.keys())
-        pair_closes = ''.join(re.escape(v['close']) for v in self.character_pairs.values())
+        # Full Sweep Mode matcher
+        self.build_matcher()
+
 
-        token_pattern_str = (
-            rf'[{prefix_chars}]{self.prefix_pattern.pattern}'
-            rf'|[{pair_opens}]{self.word_pattern.pattern}[{pair_closes}]'
-            rf'|{self.url_pattern.pattern}'
-            rf'|{self.word_pattern.pattern}'
-        )
-        self.token_pattern = re.compile(token_pattern_str)
+    # Compiles every prefix and character pair opener into one trie (call again after changing prefixes/character_pairs)
+    def build_matcher(self):
+        self.matcher = TokenMatcher(
+            self.prefixes, self.character_pairs,
+            self.prefix_pattern, self.word_pattern, self.url_pattern, self.word_pattern)
 
 
     def load_config(self):
-        db = ParserDB()
+        db = ParserDB(self.db_path, shared=self.shared)
         config = db.get_all_config()
         db.close()
         # Dynamically set settings based on DEFAULT_CONFIG
@@ -54,52 +71,111 @@ class Parser:
 
 
     def loads_data_url_cache(self):
-        db = ParserDB()
+        db = ParserDB(self.db_path)
         rows = db.conn.execute(
             "SELECT url, title, fetch_time, last_accessed FROM links ORDER BY last_accessed"
         ).fetchall()
 
+        # Rows saved before canonicalization are merged under their canonical key (most recent wins)
         for url, title, fetch_time, last_accessed in rows:
-            self.url_cache[url] = (title, fetch_time, last_accessed)
+            key = self.canonicalize_url(url)
+            self.url_cache[key] = (title, fetch_time, last_accessed)
+            self.url_cache.move_to_end(key)
+        self.links_synced = int(time.time())
         db.close()
 
 
-    def extract_prefix(self, word):
-        if (word and word[0] in self.prefixes 
-            and self.prefix_pattern.fullmatch(word[1:])):
+    # Adds links another process saved since this parser last read the table (main.py --prefetch on the same database)
+    def reload_links(self, db):
+        if self.shared:
+            return
+        rows = db.conn.execute(
+            "SELECT url, title, fetch_time, last_accessed FROM links WHERE last_accessed >= ? AND title IS NOT NULL ORDER BY last_accessed",
+            (self.links_synced,)
+        ).fetchall()
+        self.links_synced = int(time.time())
 
-            key = self.prefixes[word[0]]
-            value = word[1:]
+        for url, title, fetch_time, last_accessed in rows:
+            cached = self.url_cache.get(url)
+            if cached is None:
+                self.url_cache[url] = (title, fetch_time, last_accessed)
+            elif cached[0] is not None and last_accessed > cached[2]:
+                # Touched by the other process (already cached links in a prefetch), so it's recently used here too
+                self.url_cache[url] = (title, fetch_time, last_accessed)
+                self.url_cache.move_to_end(url)
+        while len(self.url_cache) > self.MAX_CACHE_SIZE:
+            self.url_cache.popitem(last=False) # LRU eviction
+
+
+    def sync_links(self):
+        db = ParserDB(self.db_path, shared=self.shared)
+        try:
+            self.reload_links(db)
+        finally:
+            db.close()
 
-            return key, value
-        return None
 
+    def extract_prefix(self, word):
+        for opener_end, kind, category, _ in self.matcher.openers_at(word):
+            if kind == "prefix" and self.prefix_pattern.fullmatch(word, opener_end):
+                return category, word[opener_end:]
+        return None
 
+    # Takes the token before trailing punctuation is removed, since closers may be punctuation (:emoji:)
     def extract_character_pairs(self, word):
-        if (word and word[0] in self.character_pairs and word[-1] == (self.character_pairs[word[0]]['close'])
-            and len(word[1:-1]) <= self.max_pair_length
-            and self.word_pattern.fullmatch(word[1:-1])):
-
-            key = self.character_pairs[word[0]]['category']
-            value = word[1:-1]
-
-            return key, value
+        for opener_end, kind, category, close in self.matcher.openers_at(word):
+            if kind != "pair":
+                continue
+            end = word.rfind(close, opener_end)
+            if end == -1 or word[end + len(close):].strip(TRAILING_PUNCTUATION):
+                continue
+            value = word[opener_end:end]
+            if len(value) <= self.max_pair_length and self.word_pattern.fullmatch(value):
+                return category, value
         return None
 
-    # Runs asynchronously (async) while avoiding blocking library (urllib.request) by using run_in_executor (runs in seperate thread(s))
+    # Cache key for a link so that variants of the same page share one fetch
+    # (https://Example.com:443/?utm_source=x#top -> https://example.com/)
+    def canonicalize_url(self, word):
+        url = word if SCHEME_PATTERN.match(word) else f"{DEFAULT_URL_SCHEME}://{word}"
+        try:
+            parts = urllib.parse.urlsplit(url)
+            scheme = parts.scheme.lower()
+            host = parts.hostname or ""
+            port = parts.port
+        except ValueError:
+            return word
+
+        if ':' in host: # IPv6
+            host = f"[{host}]"
+        if port and port != {'http': 80, 'https': 443}.get(scheme):
+            host = f"{host}:{port}"
+        if '@' in parts.netloc:
+            host = f"{parts.netloc.rsplit('@', 1)[0]}@{host}"
+
+        path = parts.path.rstrip('/') or '/'
+
+        # Kept parameters stay exactly as written, since the canonical link is also the one fetched
+        query = '&'.join(
+            pair for pair in parts.query.split('&')
+            if not self.is_tracking_param(urllib.parse.unquote_plus(pair.split('=', 1)[0]))
+        ) if parts.query else ''
+
+        return urllib.parse.urlunsplit((scheme, host, path, query, ''))
+
+    def is_tracking_param(self, key):
+        return any(key.startswith(p) if p.endswith('_') else key == p for p in self.tracking_params)
+
+    # Runs asynchronously (async) while avoiding blocking fetcher (urllib.request by default) by using run_in_executor (runs in seperate thread(s))
     async def extract_website_title(self, word):
         loop = asyncio.get_running_loop()
-        
-        def fetch():
-            with urllib.request.urlopen(word, timeout=5) as response:
-                return response.read().decode('utf-8', errors='ignore')
-            
-        title = "No title found"
+
+        title = NO_TITLE
         duration = 0.0
 
         try:
             start = time.perf_counter()
-            html = await loop.run_in_executor(None, fetch)
+            html = await loop.run_in_executor(None, self.fetcher.fetch, word)
             elapsed = round(time.perf_counter() - start, 3)
 
             if (match := self.title_pattern.search(html)):
@@ -107,24 +183,151 @@ class Parser:
                 if len(extracted_title) <= self.max_title_length:
                     title = extracted_title
                     duration = elapsed
+        except FetcherError:
+            raise
         except Exception:
             pass
 
         return title, duration
 
 
-    async def parse(self, message, mode):
-        result = copy.deepcopy(RESULT_TEMPLATE)
+    def get_shared_link(self, db, key):
+        row = db.get_link(key)
+        if row is None or row[0] is None:
+            return None
+        db.touch_link(key, int(time.time()))
+        db.conn.commit()
+        title, duration, _ = row
+        return title, duration
 
-        tasks = []
+    # Shared cache - each link is fetched by one worker at a time (fetch lease), the others wait for its result in the database
+    async def fetch_shared(self, key):
+        lease = f"fetch:{key}"
+        owner = uuid.uuid4().hex # Per fetch, so two parses in the same worker don't both hold the lease
+
+        while True:
+            db = ParserDB(self.db_path, shared=True)
+            try:
+                if (cached := self.get_shared_link(db, key)):
+                    return cached
+                if db.claim(lease, owner, FETCH_LEASE_TIME):
+                    # Another worker may have saved the link and released its lease since the first check
+                    if (cached := self.get_shared_link(db, key)):
+                        db.release(lease, owner)
+                        db.conn.commit()
+                        return cached
+                    break
+            finally:
+                db.close()
+            await asyncio.sleep(SHARED_POLL_INTERVAL)
+
+        # The lease is always released, so other workers don't wait out FETCH_LEASE_TIME after a failed or cancelled fetch
+        saved = False
+        try:
+            title, duration = await self.extract_website_title(key)
+
+            db = ParserDB(self.db_path, shared=True)
+            try:
+                db.add_link(key, title, duration, int(time.time()))
+                db.release(lease, owner)
+                db.conn.commit()
+                saved = True
+            finally:
+                db.close()
+        finally:
+            if not saved:
+                db = ParserDB(self.db_path, shared=True)
+                try:
+                    db.release(lease, owner)
+                    db.conn.commit()
+                finally:
+                    db.close()
+
+        return title, duration
+
+
+    # Warms the link cache before the links are posted (at most max_concurrency fetches at once)
+    # progress(done, total, url, title, fetch_time) is called after each fetch, returns a timing summary
+    async def prefetch(self, urls, max_concurrency=8, progress=None):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+
+        start = time.perf_counter()
+        keys = list(dict.fromkeys(self.canonicalize_url(url.strip()) for url in urls if url.strip()))
+        if len(keys) > self.MAX_CACHE_SIZE:
+            raise ValueError(f"Can't prefetch {len(keys)} links into a cache of {self.MAX_CACHE_SIZE} (raise Max LRU Cache Size)")
+
+        db = ParserDB(self.db_path, shared=self.shared)
+        try:
+            if self.shared:
+                cached = {key: row[:2] for key in keys if (row := db.get_link(key)) and row[0] is not None}
+            else:
+                cached = {key: self.url_cache[key][:2] for key in keys
+                          if key in self.url_cache and self.url_cache[key][0] is not None}
+        finally:
+            db.close()
+
+        to_fetch = [key for key in keys if key not in cached]
+        semaphore = asyncio.Semaphore(max_concurrency)
+        done = 0
+
+        async def fetch(key):
+            nonlocal done
+            async with semaphore:
+                # Shared mode takes the fetch lease, so a worker parsing the same link doesn't fetch it again
+                if self.shared:
+                    title, duration = await self.fetch_shared(key)
+                else:
+                    title, duration = await self.extract_website_title(key)
+            done += 1
+            if progress:
+                progress(done, len(to_fetch), key, title, duration)
+            return key, (title, duration)
+
+        fetched = dict(await asyncio.gather(*(fetch(key) for key in to_fetch)))
+
+        # Already cached links are touched too, so every prefetched link is among the most recently used
+        now = int(time.time())
+        rows = [(key, *(fetched.get(key) or cached[key]), now) for key in keys]
+        evicted = []
+        if not self.shared:
+            for key, title, duration, time_seen in rows:
+                self.url_cache[key] = (title, duration, time_seen)
+                self.url_cache.move_to_end(key)
+            while len(self.url_cache) > self.MAX_CACHE_SIZE:
+                evicted.append(self.url_cache.popitem(last=False)[0]) # LRU eviction
+
+        db = ParserDB(self.db_path, shared=self.shared)
+        try: # One transaction for every link
+            db.add_links(rows)
+            db.conn.executemany("DELETE FROM links WHERE url = ?", [(url,) for url in evicted])
+            db.conn.commit()
+        finally:
+            db.close()
+
+        durations = [duration for _, duration in fetched.values()]
+        return {
+            "links": len(keys),
+            "fetched": len(fetched),
+            "already_cached": len(cached),
+            "no_title": sum(title == NO_TITLE for title, _ in fetched.values()),
+            "elapsed": round(time.perf_counter() - start, 3),
+            "total_fetch_time": round(sum(durations), 3),
+            "slowest_fetch": max(durations, default=0.0)
+        }
+
+
+    # Sorts a message into RESULT_TEMPLATE categories without fetching or saving anything ("links" holds the raw links)
+    def extract_tokens(self, message, mode):
+        result = copy.deepcopy(RESULT_TEMPLATE)
 
         if mode == "Full_Sweep":
-            words = self.token_pattern.findall(message)
+            words = self.matcher.scan(message)
         else:
             words = message.split()
 
-        for word in words:
-            word = word.rstrip('.,!?;:')
+        for token in words:
+            word = token.rstrip(TRAILING_PUNCTUATION)
 
             # Prefixes (mentions, hashtags, etc) - allows letters, numbers, underscores
             if (extracted_prefix := self.extract_prefix(word)):
@@ -132,80 +335,212 @@ class Parser:
                 result[key].append(value)
 
             # Character Pairs (emoticons, etc) - allows only letters and numbers
-            elif (extracted_character_pairs := self.extract_character_pairs(word)):
+            elif (extracted_character_pairs := self.extract_character_pairs(token)):
                 key, value = extracted_character_pairs
                 result[key].append(value)
 
             # Links - Start with https(s):// or www.
             elif self.url_pattern.match(word):
-                # Attempts retrieval from cache
-                cached = self.url_cache.get(word)
+                result["links"].append(word)
+
+            # Word Count - Any letter(s) or number(s)
+            elif self.word_pattern.search(word):
+                result["words"] += 1
+
+        return result
 
-                # Ensures LRU cache order by adding word to cache before async execution
-                if cached is None:
+
+    # Parses one message into a RESULT_TEMPLATE dict with link titles, without saving it (see save_results)
+    async def parse_result(self, message, mode):
+        result = self.extract_tokens(message, mode)
+        links, result["links"] = result["links"], []
+
+        tasks = []
+        fetches = {}
+
+        for word in links:
+            # Attempts retrieval from cache (original link is still shown in output)
+            key = self.canonicalize_url(word)
+            cached = self.url_cache.get(key)
+
+            if key in fetches:
+                # Same link earlier in this message, shares its fetch
+                tasks.append((word, key))
+
+            elif key in self.in_flight:
+                # Another message is fetching it right now, shares that fetch
+                fetches[key] = self.in_flight[key]
+                tasks.append((word, key))
+
+            # Ensures LRU cache order by adding key to cache before async execution
+            elif self.shared or cached is None:
+                if not self.shared:
                     now = int(time.time())
-                    self.url_cache[word] = (None, None, now)  # Add to cache
-                    self.url_cache.move_to_end(word)
+                    self.url_cache[key] = (None, None, now)  # Add to cache
+                    self.url_cache.move_to_end(key)
 
                     if len(self.url_cache) > self.MAX_CACHE_SIZE:
                         self.url_cache.popitem(last=False) # LRU eviction
 
-                    task = self.extract_website_title(word)
-                    tasks.append((word, task))
+                fetches[key] = self.in_flight[key] = asyncio.ensure_future(self.fetch_title(key))
+                tasks.append((word, key))
 
-                elif isinstance(cached, tuple):
-                    self.url_cache.move_to_end(word)
-                    title, duration, _ = cached
-                    result["links"].append({
-                        "url": word,
-                        "title": title,
-                        "fetch_time": duration
-                    })
-
-                else:
-                    # Appends again to be displayed correct amount of times
-                    tasks.append((word, cached))
-                
-            # Word Count - Any letter(s) or number(s)
-            elif self.word_pattern.search(word):
-                result["words"] += 1
+            else:
+                self.url_cache.move_to_end(key)
+                title, duration, _ = cached
+                result["links"].append({
+                    "url": word,
+                    "title": title,
+                    "fetch_time": duration
+                })
 
         if tasks:
-            # Runs tasks (extract_website_title) asynchronously per link
-            titles = await asyncio.gather(*(task for _, task in tasks))
-            for (url, _), (title, duration) in zip(tasks, titles):
+            # Runs fetches asynchronously, once per unique link
+            # Shielded, other messages may be waiting on the same fetch if this one is cancelled
+            titles = dict(zip(fetches, await asyncio.gather(*(asyncio.shield(f) for f in fetches.values()))))
+            for url, key in tasks:
+                title, duration = titles[key]
                 result["links"].append({
                     "url": url,
                     "title": title,
                     "fetch_time": duration
                 })
-                _, _, time_seen = self.url_cache[url]
-                self.url_cache[url] = (title, duration, time_seen) # Adds data to cache
 
+        return result
+
+
+    # Fetches one link (at most fetch_semaphore fetches at once) and adds it to the cache
+    async def fetch_title(self, key):
+        semaphore = self.fetch_semaphore
+        if semaphore:
+            await semaphore.acquire()
+        try:
+            if self.shared:
+                return await self.fetch_shared(key)
+
+            title, duration = await self.extract_website_title(key)
+            if key in self.url_cache:
+                _, _, time_seen = self.url_cache[key]
+                self.url_cache[key] = (title, duration, time_seen) # Adds data to cache
+            return title, duration
+        finally:
+            if semaphore:
+                semaphore.release()
+            self.in_flight.pop(key, None)
+            # Cancelled before finishing, the placeholder would otherwise look like a cached link without a title
+            if key in self.url_cache and self.url_cache[key][0] is None:
+                del self.url_cache[key]
+
+
+    # Saves stats and the link cache for a batch of parse_result results in one transaction
+    def save_results(self, results):
         try: # Add data from cache to database
-            db = ParserDB()
+            db = ParserDB(self.db_path, shared=self.shared)
             list_categories = [k for k, v in RESULT_TEMPLATE.items() if isinstance(v, list) and k != "links"]
-            for category in list_categories:
-                for value in result[category]:
-                    if isinstance(value, (str, int)):
-                        db.add(category, value)      
-
-            for url, (title, fetch_time, time_seen) in self.url_cache.items():
-                db.add_link(url, title, fetch_time, time_seen)
-            
-            # Update database with LRU cache
-            cache_urls = set(self.url_cache.keys())
-            db_urls = set(row[0] for row in db.conn.execute("SELECT url FROM links"))
-            urls_to_remove = db_urls - cache_urls
-            for url in urls_to_remove:
-                db.conn.execute("DELETE FROM links WHERE url = ?", (url,))
+            for result in results:
+                for category in list_categories:
+                    for value in result[category]:
+                        if isinstance(value, (str, int)):
+                            db.add(category, value)
+
+            if self.shared:
+                # Links are already saved by fetch_shared, only the worker holding the eviction lease trims them
+                if db.claim("evict", self.worker_id, EVICTION_LEASE_TIME):
+                    db.evict_links(self.MAX_CACHE_SIZE)
+            else:
+                # Otherwise links saved by another process would be deleted by the diff below
+                self.reload_links(db)
+
+                # Links still being fetched are saved by a later call
+                db.add_links([
+                    (url, title, fetch_time, time_seen)
+                    for url, (title, fetch_time, time_seen) in self.url_cache.items() if title is not None
+                ])
+
+                # Update database with LRU cache
+                cache_urls = set(self.url_cache.keys())
+                db_urls = set(row[0] for row in db.conn.execute("SELECT url FROM links"))
+                urls_to_remove = db_urls - cache_urls
+                for url in urls_to_remove:
+                    db.conn.execute("DELETE FROM links WHERE url = ?", (url,))
 
             db.conn.commit()
         finally:
-            db.conn.execute("VACUUM")
+            if not self.shared: # VACUUM needs the database to itself
+                db.conn.execute("VACUUM")
             db.close()
 
+
+    async def parse(self, message, mode):
+        self.sync_links()
+        result = await self.parse_result(message, mode)
+        self.save_results([result])
+
         return json.dumps(
             {k: v for k, v in result.items() if v}, # Removes empty items
             indent = 2,         # Json formatting
-            ensure_ascii=False) # Unicode fix for website titles
\ No newline at end of file
+            ensure_ascii=False) # Unicode fix for website titles
+
+
+    # Parses messages from an async iterable, yielding (index, result) as they finish
+    # At most max_in_flight messages are parsed (or waiting to be yielded) at once and max_fetches links fetched at once,
+    # the source isn't read any further until there's room. ordered=False yields in completion order.
+    # Results are saved to the database every flush_every messages.
+    async def parse_stream(self, messages, mode, max_in_flight=16, ordered=True, max_fetches=None, flush_every=100):
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+
+        self.sync_links()
+        source = messages.__aiter__()
+        exhausted = False
+        pending = {}    # task: index
+        finished = {}   # index: result, waiting for earlier messages (ordered)
+        next_index = 0
+        next_yield = 0
+        unsaved = []
+
+        previous_semaphore = self.fetch_semaphore
+        self.fetch_semaphore = asyncio.Semaphore(max_fetches or max_in_flight)
+        try:
+            while True:
+                while not exhausted and len(pending) + len(finished) < max_in_flight:
+                    try:
+                        message = await source.__anext__()
+                    except StopAsyncIteration:
+                        exhausted = True
+                        break
+                    pending[asyncio.ensure_future(self.parse_result(message, mode))] = next_index
+                    next_index += 1
+
+                if not pending:
+                    break
+
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                completed = []
+                for task in done:
+                    index = pending.pop(task)
+                    result = task.result()
+                    unsaved.append(result)
+                    if ordered:
+                        finished[index] = result
+                    else:
+                        completed.append((index, result))
+
+                if ordered:
+                    while next_yield in finished:
+                        completed.append((next_yield, finished.pop(next_yield)))
+                        next_yield += 1
+
+                if len(unsaved) >= flush_every:
+                    self.save_results(unsaved)
+                    unsaved = []
+
+                for item in completed:
+                    yield item
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            self.fetch_semaphore = previous_semaphore
+            if unsaved:
+                self.save_results(unsaved)
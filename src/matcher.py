@@ -0,0 +1,74 @@
+import re
+
+# Marks the end of an opener in the trie (can't collide with a character)
+END = None
+
+class TokenMatcher:
+    def __init__(self, prefixes, character_pairs, prefix_pattern, pair_pattern, url_pattern, word_pattern):
+        self.prefix_pattern = prefix_pattern
+        self.pair_pattern = pair_pattern
+        self.plain_pattern = re.compile(rf'{url_pattern.pattern}|{word_pattern.pattern}')
+
+        # Trie of every opener string, each end node holds ('prefix', category, None) or ('pair', category, close)
+        # Prefix entries come first so they win over a pair with the same opener (same as the old regex alternation)
+        self.root = {}
+        for opener, category in prefixes.items():
+            self.insert(opener, ("prefix", category, None))
+        for opener, pair in character_pairs.items():
+            self.insert(opener, ("pair", pair["category"], pair["close"]))
+
+        # Positions where a token can start: an opener's first character or a word character (urls start with h/w)
+        first_chars = ''.join(re.escape(c) for c in self.root)
+        self.start_pattern = re.compile(rf'[{first_chars}A-Za-z0-9]' if first_chars else r'[A-Za-z0-9]')
+
+
+    def insert(self, opener, entry):
+        if not opener:
+            raise ValueError("Opener must be at least one character")
+        node = self.root
+        for char in opener:
+            node = node.setdefault(char, {})
+        node.setdefault(END, []).append(entry)
+
+
+    # All openers that start at text[pos], longest first, as (opener_end, kind, category, close)
+    def openers_at(self, text, pos=0):
+        found = []
+        node = self.root
+        for i in range(pos, len(text)):
+            node = node.get(text[i])
+            if node is None:
+                break
+            if END in node:
+                found.extend((i + 1, *entry) for entry in node[END])
+        found.sort(key=lambda item: -item[0]) # Stable, so prefixes stay ahead of pairs of the same length
+        return found
+
+
+    # Full Sweep tokenizer - one left to right pass, the cost per position depends on the opener length, not the number of token types
+    def scan(self, text):
+        tokens = []
+        pos = 0
+        while (start := self.start_pattern.search(text, pos)):
+            pos = start.start()
+            end = self.match_at(text, pos)
+            if end is None:
+                pos += 1
+            else:
+                tokens.append(text[pos:end])
+                pos = end
+        return tokens
+
+
+    # End of the token starting at text[pos] (tries prefixes, character pairs, urls, then words)
+    def match_at(self, text, pos):
+        for opener_end, kind, _, close in (self.openers_at(text, pos) if text[pos] in self.root else ()):
+            if kind == "prefix":
+                if (body := self.prefix_pattern.match(text, opener_end)):
+                    return body.end()
+            elif (body := self.pair_pattern.match(text, opener_end)) and text.startswith(close, body.end()):
+                return body.end() + len(close)
+
+        if (plain := self.plain_pattern.match(text, pos)):
+            return plain.end()
+        return None
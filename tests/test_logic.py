@@ -1,17 +1,37 @@
 import unittest
 from unittest.mock import patch
 import json
+import asyncio
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import urllib.request
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 
 from src.logic import Parser
+from src.db import ParserDB
+from src.analytics import CorpusAnalytics, mask_column
+from src.config import RESULT_TEMPLATE
+from src.fetch import UrlFetcher, RecordingFetcher, ReplayFetcher, MissingRecording
+
+# Recorded pages, so link tests run without the network
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "titles.json")
 
 class TestParser(unittest.IsolatedAsyncioTestCase):
 
     async def asyncSetUp(self):
-        self.parser = Parser()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.parser = Parser(db_path=os.path.join(self.tmp.name, "data.db"), fetcher=ReplayFetcher(FIXTURES, strict=True))
+
+    async def asyncTearDown(self):
+        self.tmp.cleanup()
 
     # Unicode in json output
-    @patch.object(Parser, 'extract_website_title', autospec=True)
-    async def test_unicode(self, mock_extract):
+    async def test_unicode(self):
         message = "https://github.com/"
         for mode in ["Safe_Scan", "Full_Sweep"]:
             with self.subTest(mode=mode):
@@ -87,6 +107,35 @@ class TestParser(unittest.IsolatedAsyncioTestCase):
                         self.assertIsInstance(link.get("title"), str)
                         self.assertTrue(len(link["title"]) > 0)
     
+    # Multi-character openers and closers (:emoji:, [[wiki]], <@id>, $TICKER, !!command)
+    async def test_multi_character_tokens(self):
+        self.parser.prefixes = {'@': 'mentions', '$': 'hashtags', '!!': 'hashtags'}
+        self.parser.character_pairs = {
+            '(': {'close': ')', 'category': 'emoticons'},
+            ':': {'close': ':', 'category': 'emoticons'},
+            '[[': {'close': ']]', 'category': 'emoticons'},
+            '<@': {'close': '>', 'category': 'mentions'},
+        }
+        self.parser.build_matcher()
+        message = "hi <@123> @bob :smile: see [[wiki]], $AAPL !!deploy (yay)."
+        for mode in ["Safe_Scan", "Full_Sweep"]:
+            with self.subTest(mode=mode):
+                result = await self.parser.parse(message, mode)
+                result_dict = json.loads(result)
+                self.assertListEqual(result_dict.get("mentions"), ["123", "bob"])
+                self.assertListEqual(result_dict.get("emoticons"), ["smile", "wiki", "yay"])
+                self.assertListEqual(result_dict.get("hashtags"), ["AAPL", "deploy"])
+                self.assertEqual(result_dict.get("words"), 2)
+
+    async def test_longest_opener_wins(self):
+        self.parser.prefixes = {'!': 'mentions', '!!': 'hashtags'}
+        self.parser.build_matcher()
+        for mode in ["Safe_Scan", "Full_Sweep"]:
+            with self.subTest(mode=mode):
+                result_dict = json.loads(await self.parser.parse("!user !!command", mode))
+                self.assertListEqual(result_dict.get("mentions"), ["user"])
+                self.assertListEqual(result_dict.get("hashtags"), ["command"])
+
     async def test_multiple_spaces_between_words(self):
         message = "hello    world   this  is   spaced"
         for mode in ["Safe_Scan", "Full_Sweep"]:
@@ -161,9 +210,49 @@ class TestParser(unittest.IsolatedAsyncioTestCase):
         for mode in ["Safe_Scan", "Full_Sweep"]:
             with self.subTest(mode=mode):
                 await self.parser.parse(message, mode)
-                cached = self.parser.url_cache.get("https://example.com")
+                cached = self.parser.url_cache.get(self.parser.canonicalize_url("https://example.com"))
                 self.assertIsInstance(cached, tuple)
 
+    def test_canonicalize_url(self):
+        canonical = "https://example.com/"
+        for url in [
+            "https://Example.com/",
+            "https://example.com",
+            "HTTPS://EXAMPLE.COM:443",
+            "https://example.com/#top",
+            "https://example.com/?utm_source=news&utm_medium=email",
+            "https://example.com?fbclid=abc123",
+        ]:
+            with self.subTest(url=url):
+                self.assertEqual(self.parser.canonicalize_url(url), canonical)
+
+        self.assertEqual(self.parser.canonicalize_url("www.Example.com/en/"), "https://www.example.com/en")
+        self.assertEqual(self.parser.canonicalize_url("http://example.com:80/a"), "http://example.com/a")
+        self.assertEqual(self.parser.canonicalize_url("http://example.com:8080/a"), "http://example.com:8080/a")
+        self.assertEqual(
+            self.parser.canonicalize_url("https://example.com/watch?v=1&utm_campaign=x"),
+            "https://example.com/watch?v=1")
+        # Links with :// in the query still get a scheme, kept parameters aren't re-encoded
+        self.assertEqual(
+            self.parser.canonicalize_url("www.google.com/url?q=https://x.com&utm_source=chat"),
+            "https://www.google.com/url?q=https://x.com")
+        self.assertEqual(self.parser.canonicalize_url("https://x.com/search?flag"), "https://x.com/search?flag")
+        self.assertEqual(
+            self.parser.canonicalize_url("https://x.com/search?q=a+b%21&utm_medium=x&page=2"),
+            "https://x.com/search?q=a+b%21&page=2")
+
+    # Variants of one link share a single fetch, output keeps each original link
+    @patch.object(Parser, 'extract_website_title', autospec=True)
+    async def test_url_variants_share_fetch(self, mock_extract):
+        mock_extract.return_value = ("Example Domain", 0.1)
+        self.parser.url_cache.clear()
+        message = "https://Example.com/ https://example.com https://example.com/?utm_source=chat#top"
+        result = await self.parser.parse(message, "Safe_Scan")
+        links = json.loads(result).get("links", [])
+        mock_extract.assert_called_once_with(self.parser, "https://example.com/")
+        self.assertListEqual([link["url"] for link in links], message.split())
+        self.assertTrue(all(link["title"] == "Example Domain" for link in links))
+
     async def test_url_fetch_time(self):
         message = "https://example.com"
         for mode in ["Safe_Scan", "Full_Sweep"]:
@@ -177,5 +266,489 @@ class TestParser(unittest.IsolatedAsyncioTestCase):
                 self.assertGreaterEqual(links[0]["fetch_time"], 0.0)
 
 
+
+class TestPrefetch(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.parser = Parser(db_path=os.path.join(self.tmp.name, "prefetch.db"), fetcher=ReplayFetcher(FIXTURES, strict=True))
+
+    async def asyncTearDown(self):
+        self.tmp.cleanup()
+
+    async def test_prefetch_then_parse_is_cache_hit(self):
+        in_flight = 0
+        max_in_flight = 0
+
+        async def fake_extract(parser, url):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return f"Title of {url}", 0.01
+
+        urls = [f"https://example.com/{i}" for i in range(10)] + ["www.example.org", "https://example.com/0/"]
+        seen = []
+        with patch.object(Parser, 'extract_website_title', autospec=True, side_effect=fake_extract) as mock_extract:
+            summary = await self.parser.prefetch(urls, max_concurrency=3, progress=lambda *args: seen.append(args))
+            self.assertEqual(mock_extract.call_count, 11)
+            self.assertLessEqual(max_in_flight, 3)
+            self.assertEqual(len(seen), 11)
+            self.assertEqual(summary["links"], 11)
+            self.assertEqual(summary["fetched"], 11)
+
+            result = json.loads(await self.parser.parse("see www.example.org and https://example.com/5", "Safe_Scan"))
+            self.assertEqual(mock_extract.call_count, 11)
+            self.assertEqual(result["links"][0]["title"], "Title of https://www.example.org/")
+
+            summary = await self.parser.prefetch(urls)
+            self.assertEqual(summary["already_cached"], 11)
+            self.assertEqual(mock_extract.call_count, 11)
+
+        db = ParserDB(self.parser.db_path)
+        self.assertEqual(db.conn.execute("SELECT COUNT(*) FROM links").fetchone()[0], 11)
+        db.close()
+
+    # Prefetch from another process (main.py --prefetch) while this parser is already running
+    async def test_prefetch_reaches_running_parser(self):
+        live = self.parser
+        await live.parse("https://example.com/", "Safe_Scan")
+        with patch.object(Parser, 'extract_website_title', autospec=True, return_value=("Prefetched", 0.2)) as mock_extract:
+            await Parser(db_path=live.db_path).prefetch(["https://example.com/a"])
+            mock_extract.reset_mock()
+            result = json.loads(await live.parse("https://example.com/a", "Safe_Scan"))
+            mock_extract.assert_not_called()
+        self.assertEqual(result["links"][0]["title"], "Prefetched")
+
+        db = ParserDB(live.db_path)
+        self.assertIsNotNone(db.get_link("https://example.com/a"))
+        db.close()
+
+    # Prefetching a link the running parser already has at its LRU tail keeps it from being evicted next
+    async def test_prefetch_touches_cached_link_in_running_parser(self):
+        live = self.parser
+        live.MAX_CACHE_SIZE = 4
+        now = time.time()
+        with patch.object(Parser, 'extract_website_title', autospec=True, return_value=("Title", 0.1)) as mock_extract:
+            with patch("src.logic.time.time", return_value=now - 100): # Cached a while ago
+                for page in "abcd":
+                    await live.parse(f"https://example.com/{page}", "Safe_Scan")
+
+            with patch("src.logic.time.time", return_value=now):
+                summary = await Parser(db_path=live.db_path).prefetch(["https://example.com/a"])
+            self.assertEqual(summary["already_cached"], 1)
+
+            with patch("src.logic.time.time", return_value=now + 100): # Live traffic later on
+                await live.parse("https://example.com/e", "Safe_Scan")
+                mock_extract.reset_mock()
+                await live.parse("https://example.com/a", "Safe_Scan")
+            mock_extract.assert_not_called()
+
+    # Shared mode prefetch waits on a worker's fetch lease instead of fetching the link again
+    async def test_shared_prefetch_respects_fetch_lease(self):
+        parser = Parser(db_path=self.parser.db_path, shared=True)
+        key = "https://example.com/x"
+        db = ParserDB(parser.db_path, shared=True)
+        db.claim(f"fetch:{key}", "worker", 60)
+        db.close()
+
+        with patch.object(Parser, 'extract_website_title', autospec=True, return_value=("Prefetched", 0.1)) as mock_extract:
+            task = asyncio.ensure_future(parser.prefetch([key]))
+            await asyncio.sleep(0.1)
+            self.assertFalse(task.done())
+
+            db = ParserDB(parser.db_path, shared=True)
+            db.add_link(key, "From worker", 0.3, int(time.time()))
+            db.release(f"fetch:{key}", "worker")
+            db.conn.commit()
+            db.close()
+
+            await task
+            mock_extract.assert_not_called()
+
+        db = ParserDB(parser.db_path, shared=True)
+        self.assertEqual(db.get_link(key)[0], "From worker")
+        db.close()
+
+    async def test_prefetch_needs_concurrency(self):
+        with self.assertRaises(ValueError):
+            await self.parser.prefetch(["https://example.com/"], max_concurrency=0)
+
+    async def test_prefetch_larger_than_cache(self):
+        self.parser.MAX_CACHE_SIZE = 2
+        with self.assertRaises(ValueError):
+            await self.parser.prefetch(["https://a.com", "https://b.com", "https://c.com"])
+
+
+class TestFetchers(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, "fetch.db")
+        self.fixtures = os.path.join(self.tmp.name, "recorded.json")
+
+    async def asyncTearDown(self):
+        self.tmp.cleanup()
+
+    async def test_record_then_replay(self):
+        with LocalSite() as site:
+            urls = [f"{site.base}/page{i}" for i in range(3)]
+            parser = Parser(db_path=self.db_path, fetcher=RecordingFetcher(self.fixtures, site.fetcher()))
+            recorded = json.loads(await parser.parse(" ".join(urls) + " https://unreachable.invalid", "Safe_Scan"))
+
+        # Server is gone, titles come from the fixture file
+        os.remove(self.db_path)
+        parser = Parser(db_path=self.db_path, fetcher=ReplayFetcher(self.fixtures))
+        replayed = json.loads(await parser.parse(" ".join(urls) + " https://unreachable.invalid", "Safe_Scan"))
+        titles = [link["title"] for link in replayed["links"]]
+        self.assertListEqual(titles, [link["title"] for link in recorded["links"]])
+        self.assertListEqual(titles, ["Page /page0", "Page /page1", "Page /page2", "No title found"])
+
+    # Simulated latency: links in one message are fetched concurrently, repeats come from the cache
+    async def test_replay_latency_concurrency_and_cache(self):
+        with open(self.fixtures, "w", encoding="utf-8") as f:
+            json.dump({f"https://example.com/{i}": {"html": f"<title>Page {i}</title>"} for i in range(5)}, f)
+        fetcher = CountingFetcher(ReplayFetcher(self.fixtures, latency=0.1))
+        parser = Parser(db_path=self.db_path, fetcher=fetcher)
+        message = " ".join(f"https://example.com/{i}" for i in range(5))
+
+        first = json.loads(await parser.parse(message, "Full_Sweep"))
+        self.assertEqual(fetcher.calls, 5)
+        self.assertGreater(fetcher.max_active, 1)
+        self.assertTrue(all(link["fetch_time"] >= 0.1 for link in first["links"]))
+
+        second = json.loads(await parser.parse(message, "Full_Sweep"))
+        self.assertEqual(fetcher.calls, 5)
+        self.assertListEqual(second["links"], first["links"]) # Same recorded fetch_time
+
+    async def test_replay_missing_url(self):
+        with open(self.fixtures, "w", encoding="utf-8") as f:
+            json.dump({}, f)
+        with self.assertRaises(LookupError):
+            ReplayFetcher(self.fixtures).fetch("https://example.com/")
+
+        # Strict replay fails the parse instead of returning "No title found"
+        parser = Parser(db_path=self.db_path, fetcher=ReplayFetcher(self.fixtures, strict=True))
+        with self.assertRaises(MissingRecording):
+            await parser.parse("https://example.com/", "Safe_Scan")
+        lenient = Parser(db_path=self.db_path, fetcher=ReplayFetcher(self.fixtures))
+        self.assertIn("No title found", await lenient.parse("https://example.com/", "Safe_Scan"))
+
+
+class TestParseStream(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.fixtures = os.path.join(self.tmp.name, "pages.json")
+        with open(self.fixtures, "w", encoding="utf-8") as f:
+            json.dump({f"https://example.com/{i}": {"html": f"<title>Page {i}</title>"} for i in range(20)}, f)
+        self.fetcher = ReplayFetcher(self.fixtures, latency=0.01)
+        self.parser = Parser(db_path=os.path.join(self.tmp.name, "stream.db"), fetcher=self.fetcher)
+        self.parser.MAX_CACHE_SIZE = 100
+        self.produced = 0
+
+    async def asyncTearDown(self):
+        self.tmp.cleanup()
+
+    # Producer much faster than the consumer
+    async def messages(self, count):
+        for i in range(count):
+            self.produced += 1
+            yield f"@user{i % 7} message {i} https://example.com/{i % 20}"
+
+    async def test_ordered_backpressure(self):
+        consumed = 0
+        max_ahead = 0
+        async for index, result in self.parser.parse_stream(self.messages(100), "Safe_Scan", max_in_flight=8, flush_every=30):
+            self.assertEqual(index, consumed)
+            self.assertListEqual(result["mentions"], [f"user{index % 7}"])
+            self.assertEqual(result["links"][0]["title"], f"Page {index % 20}")
+            consumed += 1
+            max_ahead = max(max_ahead, self.produced - consumed)
+            await asyncio.sleep(0.001)
+
+        self.assertEqual(consumed, 100)
+        self.assertLessEqual(max_ahead, 8)
+
+        db = ParserDB(self.parser.db_path)
+        self.assertEqual(sum(count for _, count in db.get_top("mentions", limit=10)), 100)
+        self.assertEqual(db.conn.execute("SELECT COUNT(*) FROM links").fetchone()[0], 20)
+        db.close()
+
+    async def test_unordered_caps_fetches(self):
+        fetcher = self.parser.fetcher = CountingFetcher(self.fetcher)
+        results = [item async for item in self.parser.parse_stream(
+            self.messages(60), "Full_Sweep", max_in_flight=10, ordered=False, max_fetches=3)]
+
+        self.assertEqual(sorted(index for index, _ in results), list(range(60)))
+        self.assertLessEqual(fetcher.max_active, 3)
+        self.assertEqual(fetcher.calls, 20) # Links repeated across messages in flight share one fetch
+        self.assertEqual(self.parser.in_flight, {})
+
+    # Cancelling one message doesn't cancel the fetch another message is waiting on
+    async def test_cancel_keeps_shared_fetch(self):
+        first = asyncio.ensure_future(self.parser.parse("https://example.com/1", "Safe_Scan"))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(self.parser.parse("https://example.com/1", "Safe_Scan"))
+        await asyncio.sleep(0)
+        first.cancel()
+        result = json.loads(await second)
+        self.assertEqual(result["links"][0]["title"], "Page 1")
+        with self.assertRaises(asyncio.CancelledError):
+            await first
+
+    async def test_stop_early_saves_finished_results(self):
+        stream = self.parser.parse_stream(self.messages(100), "Safe_Scan", max_in_flight=4)
+        async for index, _ in stream:
+            if index == 9:
+                break
+        await stream.aclose()
+        self.assertLessEqual(self.produced, 14)
+        # Fetches other messages might share keep running, only their placeholders are left without a title
+        self.assertTrue(all(title is not None or key in self.parser.in_flight
+                            for key, (title, _, _) in self.parser.url_cache.items()))
+        db = ParserDB(self.parser.db_path)
+        self.assertGreaterEqual(sum(count for _, count in db.get_top("mentions", limit=10)), 10)
+        db.close()
+
+
+class TestAnalytics(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.parser = Parser(db_path=os.path.join(self.tmp.name, "analytics.db"))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_corpus_report(self):
+        corpus = [
+            "@alice @bob hi there",
+            "#python (smile) https://example.com",
+            "plain words only here",
+            "https://Example.com/ again @carol",
+            "",
+        ]
+        with patch.object(Parser, 'extract_website_title', autospec=True) as mock_extract:
+            report = CorpusAnalytics(self.parser).add_corpus(corpus).report()
+            mock_extract.assert_not_called()
+
+        self.assertEqual(report["messages"], 5)
+        self.assertEqual(report["fetch_share"], 0.2) # Second example.com is a cache hit
+        self.assertLessEqual(report["bytes_per_message"], 8)
+
+        mentions = report["distributions"]["mentions"]
+        self.assertEqual(mentions["histogram"], {0: 3, 1: 1, 2: 1})
+        self.assertEqual((mentions["p50"], mentions["p90"], mentions["max"]), (0, 2, 2))
+        self.assertEqual(report["distributions"]["words"]["histogram"], {0: 2, 1: 1, 2: 1, 4: 1})
+
+        co = report["co_occurrence"]
+        self.assertEqual(co["mentions"]["mentions"], 2)
+        self.assertEqual(co["mentions"]["links"], 1)
+        self.assertEqual(co["hashtags"]["emoticons"], 1)
+        self.assertEqual(co["links"]["fetch"], 1)
+
+    # Mask column grows with the number of categories
+    def test_many_categories(self):
+        template = {f"category{i}": [] for i in range(70)}
+        template["words"] = 0
+        with patch.dict(RESULT_TEMPLATE, template, clear=True):
+            analytics = CorpusAnalytics(self.parser)
+            analytics.masks.append(analytics.fetch_bit | 1)
+            self.assertEqual(analytics.mask_size, 9)
+            self.assertEqual(analytics.co_occurrence()["category0"]["fetch"], 1)
+        for categories, size in ((7, 1), (15, 2), (31, 4), (63, 8)):
+            self.assertEqual(mask_column(categories + 1)[1], size)
+
+    # Shared mode starts from the links table, not an empty cache
+    def test_shared_mode_uses_links_table(self):
+        db = ParserDB(self.parser.db_path, shared=True)
+        db.add_link("https://example.com/", "Example Domain", 0.1, 1)
+        db.conn.commit()
+        db.close()
+        parser = Parser(db_path=self.parser.db_path, shared=True)
+        report = CorpusAnalytics(parser).add_corpus(["https://example.com", "https://example.org"]).report()
+        self.assertEqual(report["fetch_share"], 0.5)
+
+    # Counts past a column's limit are stored as the limit and reported as saturated
+    def test_saturated_counts(self):
+        analytics = CorpusAnalytics(self.parser, mode="Safe_Scan")
+        analytics.add_corpus(["@a " * 300, "@b hi"])
+        mentions = analytics.report()["distributions"]["mentions"]
+        self.assertEqual((mentions["limit"], mentions["saturated"], mentions["max"]), (255, 1, 255))
+        self.assertEqual(analytics.report()["distributions"]["words"]["saturated"], 0)
+
+        path = os.path.join(self.tmp.name, "report.csv")
+        analytics.write_report(path)
+        with open(path, encoding="utf-8") as f:
+            self.assertIn("distribution,mentions,saturated,1", f.read())
+
+    def test_write_report_csv_and_json(self):
+        analytics = CorpusAnalytics(self.parser, mode="Safe_Scan").add_corpus(["@a hi", "(x)"])
+        csv_path = os.path.join(self.tmp.name, "report.csv")
+        json_path = os.path.join(self.tmp.name, "report.json")
+        analytics.write_report(csv_path)
+        analytics.write_report(json_path)
+        with open(csv_path, encoding="utf-8") as f:
+            self.assertIn("summary,,messages,2", f.read())
+        with open(json_path, encoding="utf-8") as f:
+            self.assertEqual(json.load(f)["distributions"]["emoticons"]["max"], 1)
+
+
+# Local site that counts how many times each page is requested
+class CountingHandler(BaseHTTPRequestHandler):
+    hits = Counter()
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            self.hits[self.path] += 1
+        time.sleep(0.05) # Slow enough that workers overlap
+        body = f"<html><title>Page {self.path}</title></html>".encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+# Local HTTP stand-in for real sites
+class LocalSite:
+    def start(self):
+        CountingHandler.hits.clear()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), CountingHandler)
+        threading.Thread(target=self.server.serve_forever, args=(0.01,), daemon=True).start()
+        self.base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # Fetches straight from 127.0.0.1, ignoring any http_proxy set on the machine
+    @staticmethod
+    def fetcher():
+        return UrlFetcher(opener=urllib.request.build_opener(urllib.request.ProxyHandler({})))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+# Wraps a fetcher, counting its calls and the most fetches running at once
+class CountingFetcher:
+    def __init__(self, fetcher):
+        self.fetcher = fetcher
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.calls = 0
+
+    def fetch(self, url):
+        with self.lock:
+            self.calls += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            return self.fetcher.fetch(url)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+def shared_worker(db_path, messages, start):
+    parser = Parser(db_path=db_path, shared=True, fetcher=LocalSite.fetcher())
+    start.wait()
+    for message in messages:
+        asyncio.run(parser.parse(message, "Safe_Scan"))
+
+
+class TestSharedCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, "shared.db")
+        self.addCleanup(self.tmp.cleanup)
+        self.site = LocalSite().start()
+        self.addCleanup(self.site.stop)
+        self.base = self.site.base
+
+    # Every worker parses the same links at the same time, each page is still fetched once
+    def test_each_url_fetched_once_across_processes(self):
+        urls = [f"{self.base}/page{i}" for i in range(5)]
+        messages = [
+            " ".join(urls),
+            f"{urls[0]}/ {urls[1]}#top {urls[2]}?utm_source=chat",
+            " ".join(reversed(urls)),
+        ]
+        ctx = multiprocessing.get_context("spawn") # fork isn't available on Windows
+        start = ctx.Event()
+        workers = [ctx.Process(target=shared_worker, args=(self.db_path, messages, start)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        start.set()
+        for worker in workers:
+            worker.join(timeout=30)
+            self.assertEqual(worker.exitcode, 0)
+
+        self.assertEqual(dict(CountingHandler.hits), {f"/page{i}": 1 for i in range(5)})
+
+        conn = sqlite3.connect(self.db_path)
+        titles = dict(conn.execute("SELECT url, title FROM links"))
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM leases WHERE name LIKE 'fetch:%'").fetchone()[0], 0)
+        conn.close()
+        self.assertEqual(titles, {url: f"Page /page{i}" for i, url in enumerate(urls)})
+
+    def test_claim_is_exclusive_until_expired(self):
+        db = ParserDB(self.db_path, shared=True)
+        self.assertTrue(db.claim("evict", "a", 60))
+        self.assertTrue(db.claim("evict", "a", 60)) # Renewal by the owner
+        self.assertFalse(db.claim("evict", "b", 60))
+        self.assertTrue(db.claim("fetch:x", "b", -1))
+        self.assertTrue(db.claim("fetch:x", "c", 60)) # Expired lease is taken over
+        db.release("fetch:x", "c")
+        self.assertTrue(db.claim("fetch:x", "b", 60))
+        db.close()
+
+    # A failed fetch releases its lease right away instead of holding it for FETCH_LEASE_TIME
+    def test_failed_fetch_releases_lease(self):
+        parser = Parser(db_path=self.db_path, shared=True)
+        with patch.object(Parser, 'extract_website_title', autospec=True, side_effect=OSError("boom")):
+            with self.assertRaises(OSError):
+                asyncio.run(parser.fetch_shared("https://example.com/"))
+        db = ParserDB(self.db_path, shared=True)
+        self.assertTrue(db.claim("fetch:https://example.com/", "other", 60))
+        db.close()
+
+    def test_last_accessed_only_moves_forward(self):
+        db = ParserDB(self.db_path, shared=True)
+        db.add_link("https://example.com/", "Example", 0.1, 200)
+        db.touch_link("https://example.com/", 100)
+        db.add_link("https://example.com/", "Example", 0.1, 150)
+        self.assertEqual(db.get_link("https://example.com/"), ("Example", 0.1, 200))
+        db.close()
+
+    def test_shared_eviction_keeps_most_recent(self):
+        parser = Parser(db_path=self.db_path, shared=True)
+        parser.MAX_CACHE_SIZE = 2
+        db = ParserDB(self.db_path, shared=True)
+        for i in range(4):
+            db.add_link(f"https://example.com/{i}", f"Title {i}", 0.1, i)
+        db.conn.commit()
+        db.close()
+        asyncio.run(parser.parse("hello", "Safe_Scan"))
+        conn = sqlite3.connect(self.db_path)
+        urls = sorted(row[0] for row in conn.execute("SELECT url FROM links"))
+        conn.close()
+        self.assertEqual(urls, ["https://example.com/2", "https://example.com/3"])
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file